@@ -1,5 +1,5 @@
 #from .receive import CCPReceiveClient
-from .sock_server import SockServer
+from .sock_server import ShardedSockServer, SockServer
 
 
 server = None
@@ -10,10 +10,22 @@ def _client_accept_callback(addr, sock_client):
     pass
 
 
-def restart_server(addr, whitelist):
+def restart_server(addr, whitelist, workers=1, heartbeat_interval=None,
+                   heartbeat_max_misses=3):
+
     global server
     if server is not None:
         server.stop()
 
-    server = SockServer(addr, whitelist, _client_accept_callback)
+    if workers == 1:
+        server = SockServer(
+            addr, whitelist, _client_accept_callback,
+            heartbeat_interval=heartbeat_interval,
+            heartbeat_max_misses=heartbeat_max_misses)
+    else:
+        server = ShardedSockServer(
+            addr, whitelist, _client_accept_callback, workers,
+            heartbeat_interval=heartbeat_interval,
+            heartbeat_max_misses=heartbeat_max_misses)
+
     server.start()
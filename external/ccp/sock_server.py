@@ -1,20 +1,41 @@
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+from queue import Empty
 from select import select
 import socket
-from threading import Thread
+import sys
+from threading import Lock, Thread
+from time import monotonic, sleep
+from traceback import format_exc
 
 from .sock_client import AsyncSockClient
 
 
+SHARD_STAT_ACCEPTED = 0
+SHARD_STAT_ACTIVE = 1
+SHARD_STAT_RESTARTS = 2
+SHARD_STATS_LEN = 3
+
+
 class SockServer(Thread):
-    def __init__(self, addr, whitelist=(), client_accept_callback=None):
+    def __init__(self, addr, whitelist=(), client_accept_callback=None,
+                 reuse_port=False, heartbeat_interval=None,
+                 heartbeat_max_misses=3):
+
         super().__init__()
 
         self.running = False
         self.clients = []
         self.whitelist = whitelist
         self.client_accept_callback = client_accept_callback
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_max_misses = heartbeat_max_misses
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
         self.sock.bind(addr)
 
     def remove_client(self, client):
@@ -33,7 +54,10 @@ class SockServer(Thread):
                     client_sock.close()
                     continue
 
-                client = AsyncSockClient(self, client_sock)
+                client = AsyncSockClient(
+                    self, client_sock,
+                    heartbeat_interval=self.heartbeat_interval,
+                    heartbeat_max_misses=self.heartbeat_max_misses)
                 self.clients.append(client)
                 self.on_client_accept(addr, client)
 
@@ -54,3 +78,233 @@ class SockServer(Thread):
     def on_client_accept(self, addr, client):
         if self.client_accept_callback is not None:
             self.client_accept_callback(addr, client)
+
+
+class _ShardSockServer(SockServer):
+    def __init__(self, addr, whitelist, client_accept_callback, stats,
+                 heartbeat_interval, heartbeat_max_misses):
+
+        super().__init__(addr, whitelist, client_accept_callback,
+                         reuse_port=True,
+                         heartbeat_interval=heartbeat_interval,
+                         heartbeat_max_misses=heartbeat_max_misses)
+
+        self._stats = stats
+
+    def remove_client(self, client):
+        super().remove_client(client)
+
+        with self._stats.get_lock():
+            self._stats[SHARD_STAT_ACTIVE] -= 1
+
+    def on_client_accept(self, addr, client):
+        with self._stats.get_lock():
+            self._stats[SHARD_STAT_ACCEPTED] += 1
+            self._stats[SHARD_STAT_ACTIVE] += 1
+
+        super().on_client_accept(addr, client)
+
+
+def _run_shard(index, addr, whitelist, client_accept_callback, stats,
+               errors, heartbeat_interval, heartbeat_max_misses):
+
+    try:
+        server = _ShardSockServer(
+            addr, whitelist, client_accept_callback, stats,
+            heartbeat_interval, heartbeat_max_misses)
+        server.run()
+    except BaseException:
+        errors.put((index, format_exc()))
+        raise
+
+
+class ShardedSockServer(Thread):
+    """Runs several SockServer processes bound to the same port.
+
+    Every worker binds its own listening socket with SO_REUSEPORT, so the
+    kernel balances incoming connections between them and each worker
+    accepts and dispatches them without sharing the GIL with the others.
+    Workers that die are restarted by this thread, unless a worker dies
+    within min_uptime seconds of its start max_quick_failures times in a
+    row - then it's given up on and on_worker_failure() is called.
+
+    client_accept_callback is called inside the worker process and is
+    passed to it when the worker is started, so it (along with everything
+    it refers to) must always be picklable.
+    """
+    def __init__(self, addr, whitelist=(), client_accept_callback=None,
+                 workers=None, restart_delay=1.0, heartbeat_interval=None,
+                 heartbeat_max_misses=3, min_uptime=5.0,
+                 max_quick_failures=5, worker_failure_callback=None):
+
+        super().__init__()
+
+        self.running = False
+        self.addr = addr
+        self.whitelist = whitelist
+        self.client_accept_callback = client_accept_callback
+        self.workers = workers or os.cpu_count() or 1
+        self.restart_delay = restart_delay
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_max_misses = heartbeat_max_misses
+        self.min_uptime = min_uptime
+        self.max_quick_failures = max_quick_failures
+        self.worker_failure_callback = worker_failure_callback
+
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise OSError("ShardedSockServer requires SO_REUSEPORT, which is "
+                          "not available on this platform; use SockServer")
+
+        # Fail here, the same way SockServer does, rather than in every
+        # worker process. The first bind is made without SO_REUSEPORT so
+        # that it also fails if another SO_REUSEPORT listener (e.g. a
+        # ShardedSockServer that is still running) holds the port; the
+        # second one makes sure the workers will be able to bind.
+        for reuse_port in (False, True):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                if reuse_port:
+                    sock.setsockopt(
+                        socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+                sock.bind(addr)
+            finally:
+                sock.close()
+
+        self._processes = [None] * self.workers
+        self._start_times = [None] * self.workers
+        self._quick_failures = [0] * self.workers
+        self._last_errors = [None] * self.workers
+        self._failed = [False] * self.workers
+        self._errors = multiprocessing.Queue()
+
+        # Guards starting workers against a concurrent stop()
+        self._lock = Lock()
+        self._stats = [
+            multiprocessing.Array('q', SHARD_STATS_LEN)
+            for i in range(self.workers)
+        ]
+
+    def _start_worker(self, index):
+        stats = self._stats[index]
+        with stats.get_lock():
+            stats[SHARD_STAT_ACTIVE] = 0
+
+        process = multiprocessing.Process(
+            target=_run_shard,
+            args=(index, self.addr, self.whitelist,
+                  self.client_accept_callback, stats, self._errors,
+                  self.heartbeat_interval, self.heartbeat_max_misses),
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._start_times[index] = monotonic()
+
+    def _collect_errors(self):
+        while True:
+            try:
+                index, error = self._errors.get(timeout=0.1)
+            except Empty:
+                return
+
+            self._last_errors[index] = error
+
+    def run(self):
+        with self._lock:
+            self.running = True
+
+            for index in range(self.workers):
+                self._start_worker(index)
+
+        while self.running:
+            sentinels = [
+                process.sentinel
+                for index, process in enumerate(self._processes)
+                if not self._failed[index]
+            ]
+            if not sentinels:
+                break
+
+            wait(sentinels)
+
+            if not self.running:
+                break
+
+            self._collect_errors()
+
+            for index, process in enumerate(self._processes):
+                if self._failed[index] or process.is_alive():
+                    continue
+
+                process.join()
+                if self._last_errors[index] is None:
+                    self._last_errors[index] = (
+                        "Worker exited with code {}".format(process.exitcode))
+
+                if monotonic() - self._start_times[index] < self.min_uptime:
+                    self._quick_failures[index] += 1
+                else:
+                    self._quick_failures[index] = 0
+
+                if self._quick_failures[index] >= self.max_quick_failures:
+                    self._failed[index] = True
+                    self.on_worker_failure(index, self._last_errors[index])
+                    continue
+
+                with self._stats[index].get_lock():
+                    self._stats[index][SHARD_STAT_RESTARTS] += 1
+
+                # Don't spin if the worker keeps dying right after start
+                sleep(self.restart_delay)
+                with self._lock:
+                    if not self.running:
+                        break
+
+                    self._start_worker(index)
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+
+            self.running = False
+            for process in self._processes:
+                if process is not None and process.is_alive():
+                    process.terminate()
+
+        for process in self._processes:
+            if process is not None:
+                process.join()
+
+    def on_worker_failure(self, index, error):
+        """Called when a worker keeps crashing and won't be restarted
+        anymore."""
+        if self.worker_failure_callback is not None:
+            self.worker_failure_callback(index, error)
+        else:
+            sys.stderr.write(
+                "ShardedSockServer worker {} keeps crashing, giving up:\n"
+                "{}\n".format(index, error))
+
+    def get_stats(self):
+        workers = []
+        for index, process in enumerate(self._processes):
+            stats = self._stats[index]
+            with stats.get_lock():
+                workers.append({
+                    'pid': None if process is None else process.pid,
+                    'alive': process is not None and process.is_alive(),
+                    'failed': self._failed[index],
+                    'last_error': self._last_errors[index],
+                    'accepted': stats[SHARD_STAT_ACCEPTED],
+                    'active': stats[SHARD_STAT_ACTIVE],
+                    'restarts': stats[SHARD_STAT_RESTARTS],
+                })
+
+        return {
+            'workers': workers,
+            'accepted': sum(worker['accepted'] for worker in workers),
+            'active': sum(worker['active'] for worker in workers),
+            'restarts': sum(worker['restarts'] for worker in workers),
+        }
@@ -0,0 +1,96 @@
+import json
+
+from .constants import CommunicationMode
+from .constants import SYNC_BYTES_DELTA
+from .constants import SYNC_BYTES_FULL
+from .constants import SYNC_BYTES_RESYNC_REQUEST
+from .transmit import AsyncSRCDSClient
+
+
+class StateMirror(AsyncSRCDSClient):
+    """Keeps a local copy of a SyncedState exposed by a StateSyncReceiver
+    on the SRCDS side.
+
+    The mirrored data is available as a dict in 'state'. It should be
+    treated as read-only; any local changes are lost on the next resync.
+    """
+    def __init__(self, addr, plugin_name, key_change_callback=None,
+                 key_remove_callback=None, sync_callback=None, **kwargs):
+
+        super().__init__(addr, plugin_name, **kwargs)
+
+        self.state = {}
+        self.synced = False
+
+        self._key_change_callback = key_change_callback
+        self._key_remove_callback = key_remove_callback
+        self._sync_callback = sync_callback
+
+    def on_connected(self):
+        self.set_mode(CommunicationMode.RAW)
+        super().on_connected()
+
+    def on_data_received(self, data):
+        code, payload = data[:1], data[1:]
+
+        if code == SYNC_BYTES_FULL:
+            self._apply_snapshot(json.loads(payload.decode('utf-8')))
+            self.synced = True
+            self.on_sync()
+
+        elif code == SYNC_BYTES_DELTA:
+            # Deltas are meaningless without the snapshot they apply to
+            if not self.synced:
+                return
+
+            delta = json.loads(payload.decode('utf-8'))
+            for key in delta['d']:
+                self._remove_key(key)
+
+            for key, value in delta['s'].items():
+                self._change_key(key, value)
+
+        else:
+            super().on_data_received(data)
+
+    def _apply_snapshot(self, snapshot):
+        for key in tuple(self.state):
+            if key not in snapshot:
+                self._remove_key(key)
+
+        for key, value in snapshot.items():
+            if key not in self.state or self.state[key] != value:
+                self._change_key(key, value)
+
+    def _change_key(self, key, value):
+        old_value = self.state.get(key)
+        self.state[key] = value
+        self.on_key_change(key, old_value, value)
+
+    def _remove_key(self, key):
+        if key not in self.state:
+            return
+
+        old_value = self.state.pop(key)
+        self.on_key_remove(key, old_value)
+
+    def resync(self):
+        """Request a full snapshot from the other side."""
+        self.synced = False
+        self.send_data(SYNC_BYTES_RESYNC_REQUEST)
+
+    def on_key_change(self, key, old_value, new_value):
+        """Called when a key is added or its value changes. old_value is
+        None for new keys."""
+        if self._key_change_callback is not None:
+            self._key_change_callback(key, old_value, new_value)
+
+    def on_key_remove(self, key, old_value):
+        """Called when a key is removed from the state."""
+        if self._key_remove_callback is not None:
+            self._key_remove_callback(key, old_value)
+
+    def on_sync(self):
+        """Called after a full snapshot has been applied."""
+        if self._sync_callback is not None:
+            self._sync_callback()
@@ -163,11 +163,15 @@ class AsyncSRCDSClient(BaseSRCDSClient, Thread):
                  comm_accepted_callback=None, nobody_home_callback=None,
                  comm_end_callback=None, protocol_error_callback=None,
                  comm_error_callback=None, data_received_callback=None,
-                 connected_callback=None, connection_abort_callback=None):
+                 connected_callback=None, connection_abort_callback=None,
+                 heartbeat_interval=None, heartbeat_max_misses=3):
 
         BaseSRCDSClient.__init__(self, addr, plugin_name)
         Thread.__init__(self)
 
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_max_misses = heartbeat_max_misses
+
         self._connection_error_callback = connection_error_callback
         self._comm_accepted_callback = comm_accepted_callback
         self._nobody_home_callback = nobody_home_callback
@@ -195,11 +199,20 @@ class AsyncSRCDSClient(BaseSRCDSClient, Thread):
 
             self.sock_client = AsyncSockClient(
                 None, self.sock, self._message_receive_callback,
-                self.on_connection_abort, self.on_connection_abort)
+                self.on_connection_abort, self.on_connection_abort,
+                self.heartbeat_interval, self.heartbeat_max_misses)
 
             self.on_connected()
             self.sock_client.start()
 
+    @property
+    def rtt(self):
+        """Smoothed round-trip time in seconds, None if not measured."""
+        if self.sock_client is None:
+            return None
+
+        return self.sock_client.rtt
+
     def on_connection_error(self):
         """Called when connection to the host didn't succeed."""
         if self._connection_error_callback is not None:
@@ -2,6 +2,9 @@ from configparser import ConfigParser
 
 from paths import CUSTOM_DATA_PATH
 
+from .constants import Priority
+from .dispatch import DEFAULT_QUEUE_LIMIT, DEFAULT_WEIGHTS, DEFAULT_WORKERS
+from .dispatch import Dispatcher
 from .receive import CCPReceiveClient
 from .sock_server import SockServer
 
@@ -13,21 +16,56 @@ config = ConfigParser()
 config.read(CONFIG_FILE)
 
 server = None
+dispatcher = None
 
 
 def _client_accept_callback(addr, sock_client):
-    CCPReceiveClient(addr, sock_client)
+    CCPReceiveClient(addr, sock_client, dispatcher)
+
+
+def _create_dispatcher():
+    weights = {}
+    queue_limits = {}
+    for priority in Priority:
+        weights[priority] = config.getint(
+            'dispatch', 'weight_{}'.format(priority.name.lower()),
+            fallback=DEFAULT_WEIGHTS[priority])
+
+        queue_limits[priority] = config.getint(
+            'dispatch', 'queue_limit_{}'.format(priority.name.lower()),
+            fallback=DEFAULT_QUEUE_LIMIT)
+
+    return Dispatcher(
+        weights, queue_limits,
+        config.getint('dispatch', 'workers', fallback=DEFAULT_WORKERS))
 
 
 def restart_server():
-    global server
+    global server, dispatcher
     if server is not None:
         server.stop()
 
+    if dispatcher is not None:
+        dispatcher.stop()
+        dispatcher = None
+
+    # Without the dispatcher every connection runs its handlers on its
+    # own reader thread
+    if config.getboolean('dispatch', 'enabled', fallback=False):
+        dispatcher = _create_dispatcher()
+        dispatcher.start()
+
+    # Heartbeats are disabled unless the interval is positive
+    heartbeat_interval = config['server'].getfloat(
+        'heartbeat_interval', fallback=0)
+
     server = SockServer(
         addr=(config['server']['host'], int(config['server']['port'])),
         whitelist=config['server']['whitelist'].split(','),
-        client_accept_callback=_client_accept_callback
+        client_accept_callback=_client_accept_callback,
+        heartbeat_interval=heartbeat_interval or None,
+        heartbeat_max_misses=config['server'].getint(
+            'heartbeat_max_misses', fallback=3)
     )
     server.start()
 
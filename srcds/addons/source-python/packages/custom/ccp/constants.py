@@ -11,6 +11,11 @@ IN_BYTES_COMM_START_REQUEST_BASED = b"\x01"
 IN_BYTES_COMM_START_RAW = b"\x02"
 IN_BYTES_DATA = b"\x05"
 IN_BYTES_COMM_END = b"\x0A"
+BYTES_PING = b"\x06"
+BYTES_PONG = b"\x07"
+SYNC_BYTES_FULL = b"\x01"
+SYNC_BYTES_DELTA = b"\x02"
+SYNC_BYTES_RESYNC_REQUEST = b"\x03"
 
 
 class CommunicationMode(IntEnum):
@@ -22,3 +27,9 @@ class CommunicationMode(IntEnum):
     ERROR = 5
     CONNECTING = 6
     CONNECTED = 7
+
+
+class Priority(IntEnum):
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
@@ -0,0 +1,233 @@
+from collections import deque
+from threading import Condition
+from time import monotonic
+
+from hooks.exceptions import except_hooks
+from listeners.tick import GameThread
+
+from .constants import Priority
+
+
+DEFAULT_WEIGHTS = {
+    Priority.LOW: 1,
+    Priority.NORMAL: 4,
+    Priority.HIGH: 16,
+}
+DEFAULT_QUEUE_LIMIT = 1024
+DEFAULT_WORKERS = 4
+
+
+class _Lane:
+    def __init__(self, weight, limit):
+        self.weight = weight
+        self.limit = limit
+        self.current_weight = 0
+
+        # Sessions that have pending items and are not being handled
+        # right now, each appears at most once
+        self.sessions = deque()
+
+        self.queued = 0
+        self.max_queued = 0
+        self.dispatched = 0
+        self.blocked = 0
+        self.busy_time = 0.0
+
+
+class Dispatcher:
+    """Runs session handlers on a pool of worker threads, serving priority
+    lanes with smooth weighted round-robin.
+
+    Within a lane sessions are served round-robin one item at a time, so
+    a connection with a long backlog doesn't starve the others in its
+    lane. A session is only ever handled by one worker at a time, so its
+    items are handled in order. Besides the shared workers, one worker
+    only serves Priority.HIGH, so HIGH traffic never waits for a slow
+    handler of a lower priority.
+
+    When a lane is full, submit() blocks the calling reader thread until
+    there is room again.
+    """
+    def __init__(self, weights=None, queue_limits=None,
+                 workers=DEFAULT_WORKERS):
+
+        if weights is None:
+            weights = DEFAULT_WEIGHTS
+
+        if queue_limits is None:
+            queue_limits = {}
+
+        self.running = False
+        self._stopped = False
+        self._lanes = {
+            priority: _Lane(
+                weights[priority],
+                queue_limits.get(priority, DEFAULT_QUEUE_LIMIT)
+            ) for priority in Priority
+        }
+        self._condition = Condition()
+
+        all_lanes = tuple(self._lanes.values())
+        self._threads = [
+            GameThread(target=self._work, args=(all_lanes, ))
+            for i in range(workers)
+        ]
+        self._threads.append(GameThread(
+            target=self._work, args=((self._lanes[Priority.HIGH], ), )))
+
+    def start(self):
+        self.running = True
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, session, item, force=False):
+        """Queue 'item' to be passed to session.dispatch().
+
+        With force=True the lane limit is ignored; this is used for
+        items that must never be dropped or delayed by backpressure,
+        such as connection aborts (None items). Once the dispatcher is
+        stopped, such items are handled right away in the calling thread
+        and all others are dropped.
+        """
+        with self._condition:
+            if not self._stopped:
+                lane = self._lanes[session.priority]
+
+                if not force and lane.queued >= lane.limit:
+                    lane.blocked += 1
+                    while not self._stopped and lane.queued >= lane.limit:
+                        self._condition.wait()
+
+            if not self._stopped:
+                if session.pending is None:
+                    session.pending = deque()
+
+                session.pending.append((lane, item))
+                lane.queued += 1
+                lane.max_queued = max(lane.max_queued, lane.queued)
+
+                if not session.scheduled:
+                    session.scheduled = True
+                    lane.sessions.append(session)
+
+                self._condition.notify_all()
+                return
+
+        if force:
+            self._dispatch(session, item)
+
+    def _next_lane(self, lanes):
+        total_weight = 0
+        best_lane = None
+        for lane in lanes:
+            if not lane.sessions:
+                continue
+
+            lane.current_weight += lane.weight
+            total_weight += lane.weight
+            if (best_lane is None or
+                    lane.current_weight > best_lane.current_weight):
+
+                best_lane = lane
+
+        if best_lane is not None:
+            best_lane.current_weight -= total_weight
+
+        return best_lane
+
+    def _take_aborts(self, session):
+        aborted = False
+        if session.pending is not None:
+            aborted = any(item is None for lane, item in session.pending)
+
+        session.pending = None
+        session.scheduled = False
+        return aborted
+
+    def _dispatch(self, session, item):
+        try:
+            session.dispatch(item)
+        except Exception:
+            # Report handler errors without taking the worker down
+            except_hooks.print_exception()
+
+    def _work(self, lanes):
+        while True:
+            with self._condition:
+                lane = self._next_lane(lanes)
+                while not self._stopped and lane is None:
+                    self._condition.wait()
+                    lane = self._next_lane(lanes)
+
+                if self._stopped:
+                    return
+
+                # The session stays scheduled (and out of any lane) until
+                # this worker is done with it
+                session = lane.sessions.popleft()
+                item_lane, item = session.pending.popleft()
+                item_lane.queued -= 1
+
+                self._condition.notify_all()
+
+            start_time = monotonic()
+            self._dispatch(session, item)
+
+            with self._condition:
+                item_lane.dispatched += 1
+                item_lane.busy_time += monotonic() - start_time
+
+                aborted = False
+                if self._stopped:
+                    aborted = self._take_aborts(session)
+
+                # Priority could have changed since the items were queued
+                elif session.pending:
+                    self._lanes[session.priority].sessions.append(session)
+                    self._condition.notify_all()
+
+                else:
+                    session.pending = None
+                    session.scheduled = False
+
+            if aborted:
+                self._dispatch(session, None)
+
+    def stop(self):
+        """Stop the workers. Queued items are dropped, except for
+        connection aborts, which are handled before returning (or by the
+        worker currently busy with the session)."""
+        with self._condition:
+            if self._stopped:
+                return
+
+            self._stopped = True
+            self.running = False
+
+            aborted = []
+            for lane in self._lanes.values():
+                for session in lane.sessions:
+                    if self._take_aborts(session):
+                        aborted.append(session)
+
+                lane.sessions.clear()
+                lane.queued = 0
+
+            self._condition.notify_all()
+
+        for session in aborted:
+            self._dispatch(session, None)
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                priority: {
+                    'weight': lane.weight,
+                    'limit': lane.limit,
+                    'queued': lane.queued,
+                    'max_queued': lane.max_queued,
+                    'dispatched': lane.dispatched,
+                    'blocked': lane.blocked,
+                    'busy_time': lane.busy_time,
+                } for priority, lane in self._lanes.items()
+            }
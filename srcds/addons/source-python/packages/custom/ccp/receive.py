@@ -12,36 +12,53 @@ from .constants import OUT_BYTES_COMM_ERROR
 from .constants import OUT_BYTES_DATA
 from .constants import OUT_BYTES_NOBODY_HOME
 from .constants import OUT_BYTES_PROTOCOL_ERROR
+from .constants import Priority
 
 
+# Plugin name -> (callback, priority)
 _request_based_receiver_callbacks = {}
 _raw_receiver_classes = {}
 
+# Bumped whenever a registration goes away, so that CCPReceiveClient
+# instances know their cached callbacks may be stale
+_registry_version = 0
+
+_IN_CODE_COMM_START_REQUEST_BASED = IN_BYTES_COMM_START_REQUEST_BASED[0]
+_IN_CODE_COMM_START_RAW = IN_BYTES_COMM_START_RAW[0]
+_IN_CODE_DATA = IN_BYTES_DATA[0]
+_IN_CODE_COMM_END = IN_BYTES_COMM_END[0]
+
+
+def register_request_based_receiver_callback(
+        plugin_name, callback, priority=Priority.NORMAL):
 
-def register_request_based_receiver_callback(plugin_name, callback):
     if plugin_name in _request_based_receiver_callbacks:
         raise ValueError(
             "'{}' is already bound to handle request-based communication with "
             "plugin '{}'".format(
-                _request_based_receiver_callbacks[plugin_name],
+                _request_based_receiver_callbacks[plugin_name][0],
                 plugin_name
             )
         )
 
-    _request_based_receiver_callbacks[plugin_name] = callback
+    _request_based_receiver_callbacks[plugin_name] = (callback, priority)
 
 
 def unregister_request_based_receiver_callback(plugin_name):
+    global _registry_version
+    _registry_version += 1
+
     del _request_based_receiver_callbacks[plugin_name]
 
 
 class RequestBasedReceiver(AutoUnload):
-    def __init__(self, plugin_name):
+    def __init__(self, plugin_name, priority=Priority.NORMAL):
         self._plugin_name = plugin_name
+        self._priority = priority
 
     def __call__(self, callback):
         register_request_based_receiver_callback(
-            self._plugin_name, callback)
+            self._plugin_name, callback, self._priority)
 
         return callback
 
@@ -77,6 +94,7 @@ class RawReceiverMeta(type):
 class RawReceiver(WeakAutoUnload, metaclass=RawReceiverMeta):
     abstract = True
     plugin_name = None
+    priority = Priority.NORMAL
 
     def __init__(self, addr, ccp_receive_client):
         self.addr = addr
@@ -87,6 +105,11 @@ class RawReceiver(WeakAutoUnload, metaclass=RawReceiverMeta):
     def _unload_instance(self):
         self._unload()
 
+    def on_comm_accepted(self):
+        """Called after the other side has been told that communication
+        is accepted; data can be sent from here on."""
+        pass
+
     def on_data_received(self, data):
         pass
 
@@ -95,22 +118,88 @@ class RawReceiver(WeakAutoUnload, metaclass=RawReceiverMeta):
 
 
 class CCPReceiveClient:
-    def __init__(self, addr, sock_client):
+    __slots__ = (
+        'addr', 'sock_client', 'priority', 'pending', 'scheduled',
+        '_plugin_name', '_raw_receiver', '_mode', '_dispatcher',
+        '_request_callback', '_registry_version',
+    )
+
+    def __init__(self, addr, sock_client, dispatcher=None):
         self.addr = addr
         self.sock_client = sock_client
 
+        # Lane this connection is served in, decided by the plugin it
+        # talks to
+        self.priority = Priority.NORMAL
+
+        # Used by the dispatcher, the deque only exists while there are
+        # queued items
+        self.pending = None
+        self.scheduled = False
+
         self._plugin_name = None
         self._raw_receiver = None
         self._mode = CommunicationMode.UNDEFINED
+        self._dispatcher = dispatcher
+
+        # Request-based callback resolved at handshake, valid for as long
+        # as _registry_version matches the module-level one
+        self._request_callback = None
+        self._registry_version = -1
+
+        if dispatcher is None:
+            sock_client._message_receive_callback = self.on_message_receive
+            sock_client._connection_close_callback = self.on_connection_abort
+            sock_client._connection_abort_callback = self.on_connection_abort
+        else:
+            sock_client._message_receive_callback = self._submit_message
+            sock_client._connection_close_callback = self._submit_abort
+            sock_client._connection_abort_callback = self._submit_abort
+
+    def _submit_message(self, message):
+        self._dispatcher.submit(self, message)
+
+    def _submit_abort(self):
+        self._dispatcher.submit(self, None, force=True)
+
+    def dispatch(self, item):
+        if item is None:
+            self.on_connection_abort()
+        else:
+            self.on_message_receive(item)
+
+    @property
+    def rtt(self):
+        """Smoothed round-trip time in seconds, None if not measured."""
+        return self.sock_client.rtt
+
+    def _protocol_error(self):
+        try:
+            self.on_connection_abort()
+        finally:
+            self._raw_receiver = None
+            self._mode = CommunicationMode.ERROR
+            self.sock_client.send_message(OUT_BYTES_PROTOCOL_ERROR)
+            self.sock_client.stop()
+
+    def _resolve_request_callback(self):
+        # A single lookup, so that the callback and its priority can't
+        # come from different registrations
+        entry = _request_based_receiver_callbacks.get(self._plugin_name)
+        if entry is None:
+            self._request_callback = None
+        else:
+            self._request_callback, priority = entry
+            self.priority = priority
 
-        sock_client._message_receive_callback = self.on_message_receive
-        sock_client._connection_close_callback = self.on_connection_abort
-        sock_client._connection_abort_callback = self.on_connection_abort
+        self._registry_version = _registry_version
+        return self._request_callback
 
     def on_message_receive(self, message):
-        code, data = message[:1], message[1:]
+        # Indexing bytes gives the opcode as int without copying anything
+        code = message[0] if message else 0
 
-        if code == IN_BYTES_COMM_END:
+        if code == _IN_CODE_COMM_END:
             self.on_connection_abort()
             self._raw_receiver = None
             self._mode = CommunicationMode.ENDED
@@ -118,91 +207,89 @@ class CCPReceiveClient:
             return
 
         if self._mode == CommunicationMode.END_REQUEST_SENT:
-            self._raw_receiver = None
-            self._mode = CommunicationMode.ERROR
-            self.sock_client.send_message(OUT_BYTES_PROTOCOL_ERROR)
-            self.sock_client.stop()
+            self._protocol_error()
+            return
+
+        handler = _message_handlers[code]
+        if handler is not None:
+            handler(self, message)
+
+    def _on_comm_start(self, message):
+        if self._mode != CommunicationMode.UNDEFINED:
+            self._protocol_error()
             return
 
-        if code in (
-                IN_BYTES_COMM_START_REQUEST_BASED, IN_BYTES_COMM_START_RAW):
+        try:
+            self._plugin_name = message[1:].decode('utf-8')
+        except UnicodeDecodeError:
+            self._protocol_error()
+            return
 
-            if self._mode != CommunicationMode.UNDEFINED:
-                self._raw_receiver = None
-                self._mode = CommunicationMode.ERROR
-                self.sock_client.send_message(OUT_BYTES_PROTOCOL_ERROR)
-                self.sock_client.stop()
+        if message[0] == _IN_CODE_COMM_START_REQUEST_BASED:
+            if self._resolve_request_callback() is not None:
+                self._mode = CommunicationMode.REQUEST_BASED
+                self.sock_client.send_message(OUT_BYTES_COMM_ACCEPTED)
 
             else:
-                try:
-                    self._plugin_name = data.decode('utf-8')
-                except UnicodeDecodeError:
-                    self._mode = CommunicationMode.ERROR
-                    self.sock_client.send(OUT_BYTES_PROTOCOL_ERROR)
-                    self.sock_client.stop()
-                    return
-
-                if code == IN_BYTES_COMM_START_REQUEST_BASED:
-                    if self._plugin_name in _request_based_receiver_callbacks:
-                        self._mode = CommunicationMode.REQUEST_BASED
-                        self.sock_client.send_message(OUT_BYTES_COMM_ACCEPTED)
-
-                    else:
-                        self._mode = CommunicationMode.END_REQUEST_SENT
-                        self.sock_client.send_message(OUT_BYTES_NOBODY_HOME)
+                self._mode = CommunicationMode.END_REQUEST_SENT
+                self.sock_client.send_message(OUT_BYTES_NOBODY_HOME)
 
-                else:
-                    if self._plugin_name in _raw_receiver_classes:
-                        self._mode = CommunicationMode.RAW
-                        raw_receiver_class = _raw_receiver_classes[
-                            self._plugin_name]
+        else:
+            if self._plugin_name in _raw_receiver_classes:
+                self._mode = CommunicationMode.RAW
+                raw_receiver_class = _raw_receiver_classes[self._plugin_name]
+                self.priority = raw_receiver_class.priority
 
-                        try:
-                            self._raw_receiver = raw_receiver_class(
-                                self.addr[:], self)
-                        except:
-                            self._mode = CommunicationMode.END_REQUEST_SENT
-                            self.sock_client.send_message(OUT_BYTES_COMM_ERROR)
-                            raise
+                try:
+                    self._raw_receiver = raw_receiver_class(
+                        self.addr[:], self)
+                except:
+                    self._mode = CommunicationMode.END_REQUEST_SENT
+                    self.sock_client.send_message(OUT_BYTES_COMM_ERROR)
+                    raise
 
-                        self.sock_client.send_message(OUT_BYTES_COMM_ACCEPTED)
+                self.sock_client.send_message(OUT_BYTES_COMM_ACCEPTED)
+                self._raw_receiver.on_comm_accepted()
 
-                    else:
-                        self._mode = CommunicationMode.END_REQUEST_SENT
-                        self.sock_client.send_message(OUT_BYTES_NOBODY_HOME)
+            else:
+                self._mode = CommunicationMode.END_REQUEST_SENT
+                self.sock_client.send_message(OUT_BYTES_NOBODY_HOME)
 
+    def _on_data(self, message):
+        if self._mode == CommunicationMode.RAW:
+            self._raw_receiver.on_data_received(message[1:])
             return
 
-        if code == IN_BYTES_DATA:
-            if self._mode == CommunicationMode.REQUEST_BASED:
+        if self._mode != CommunicationMode.REQUEST_BASED:
+            return
 
-                # Check if plugin has been unloaded by now
-                if self._plugin_name not in _request_based_receiver_callbacks:
-                    self._mode = CommunicationMode.END_REQUEST_SENT
-                    self.sock_client.send_message(OUT_BYTES_NOBODY_HOME)
-                    return
+        callback = self._request_callback
+        if self._registry_version != _registry_version:
+            callback = self._resolve_request_callback()
 
-                try:
-                    response = _request_based_receiver_callbacks[
-                        self._plugin_name](self.addr[:], data)
+        # Check if plugin has been unloaded by now
+        if callback is None:
+            self._mode = CommunicationMode.END_REQUEST_SENT
+            self.sock_client.send_message(OUT_BYTES_NOBODY_HOME)
+            return
 
-                    if not isinstance(response, bytes):
-                        if isinstance(response, str):
-                            response = response.encode('utf-8')
-                        else:
-                            raise ValueError(
-                                "RequestBasedReceiver callback should "
-                                "only return bytes or str values")
+        try:
+            response = callback(self.addr[:], message[1:])
 
-                except:
-                    self._mode = CommunicationMode.END_REQUEST_SENT
-                    self.sock_client.send_message(OUT_BYTES_COMM_ERROR)
-                    raise
+            if not isinstance(response, bytes):
+                if isinstance(response, str):
+                    response = response.encode('utf-8')
+                else:
+                    raise ValueError(
+                        "RequestBasedReceiver callback should "
+                        "only return bytes or str values")
 
-                self.sock_client.send_message(OUT_BYTES_DATA + response)
+        except:
+            self._mode = CommunicationMode.END_REQUEST_SENT
+            self.sock_client.send_message(OUT_BYTES_COMM_ERROR)
+            raise
 
-            elif self._mode == CommunicationMode.RAW:
-                self._raw_receiver.on_data_received(data)
+        self.sock_client.send_message(OUT_BYTES_DATA + response)
 
     def on_connection_abort(self):
         if self._mode != CommunicationMode.RAW:
@@ -255,6 +342,17 @@ class CCPReceiveClient:
         self.sock_client.send_message(OUT_BYTES_DATA + data)
 
 
+# Opcode -> CCPReceiveClient handler, indexed by the first byte of a frame
+_message_handlers = [None] * 256
+_message_handlers[_IN_CODE_COMM_START_REQUEST_BASED] = (
+    CCPReceiveClient._on_comm_start)
+_message_handlers[_IN_CODE_COMM_START_RAW] = CCPReceiveClient._on_comm_start
+_message_handlers[_IN_CODE_DATA] = CCPReceiveClient._on_data
+
+
 @OnPluginUnloaded
 def listener_on_plugin_unloaded(plugin_name):
+    global _registry_version
+    _registry_version += 1
+
     _raw_receiver_classes.pop(plugin_name, None)
@@ -1,10 +1,38 @@
+from math import ceil
 from select import select
+import socket
+from struct import pack, unpack
+from threading import Lock
+from time import monotonic
 
 from listeners.tick import GameThread
 
+from .constants import BYTES_PING, BYTES_PONG
+
 
 CHUNK_SIZE = 4096
 LENGTH_BYTES = 3
+PING_LENGTH = 9
+RTT_SMOOTHING = 0.125
+
+_CODE_PING = BYTES_PING[0]
+_CODE_PONG = BYTES_PONG[0]
+
+
+def _enable_keepalive(sock, interval, max_misses):
+    # Let the OS reclaim half-open connections to peers that don't answer
+    # pings, roughly as fast as heartbeats would
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    seconds = max(1, int(ceil(interval)))
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, seconds)
+
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, seconds)
+
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, max_misses)
 
 
 class ConnectionClose(OSError):
@@ -14,7 +42,8 @@ class ConnectionClose(OSError):
 class AsyncSockClient(GameThread):
     def __init__(self, sock_server, sock, message_receive_callback=None,
                  connection_abort_callback=None,
-                 connection_close_callback=None):
+                 connection_close_callback=None, heartbeat_interval=None,
+                 heartbeat_max_misses=3):
 
         super().__init__()
 
@@ -23,9 +52,24 @@ class AsyncSockClient(GameThread):
         self._message_receive_callback = message_receive_callback
         self._connection_abort_callback = connection_abort_callback
         self._connection_close_callback = connection_close_callback
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_max_misses = heartbeat_max_misses
+
+        # Smoothed round-trip time in seconds, None until the first pong
+        self.rtt = None
 
         self.running = False
 
+        # Missing pongs only count once the peer has answered a ping;
+        # half-open connections to peers that never answer are left to
+        # TCP keepalive
+        self._peer_heartbeats = False
+        self._missed_heartbeats = 0
+        self._send_lock = Lock()
+
+        if heartbeat_interval is not None:
+            _enable_keepalive(sock, heartbeat_interval, heartbeat_max_misses)
+
     def _read_sock(self, length):
         data = b''
         while len(data) < length:
@@ -60,21 +104,64 @@ class AsyncSockClient(GameThread):
         message = self._read_sock(length)
         return message
 
+    def _handle_heartbeat(self, message):
+        # Any incoming frame proves that the peer is alive
+        self._missed_heartbeats = 0
+
+        code = message[0] if message else 0
+        if code == _CODE_PING:
+            self.send_message(BYTES_PONG + message[1:])
+            return True
+
+        if code == _CODE_PONG:
+            if len(message) != PING_LENGTH:
+                return True
+
+            self._peer_heartbeats = True
+
+            rtt = monotonic() - unpack('!d', message[1:])[0]
+            if self.rtt is None:
+                self.rtt = rtt
+            else:
+                self.rtt += RTT_SMOOTHING * (rtt - self.rtt)
+
+            return True
+
+        return False
+
     def send_message(self, message):
         length = len(message)
         length_bytes = length.to_bytes(LENGTH_BYTES, byteorder='big')
 
         try:
-            self._write_sock(length_bytes + message)
+            with self._send_lock:
+                self._write_sock(length_bytes + message)
         except OSError:
             self.stop()
             self.on_connection_abort()
 
+    def ping(self):
+        self._missed_heartbeats += 1
+        self.send_message(BYTES_PING + pack('!d', monotonic()))
+
     def run(self):
         self.running = True
 
-        r, w, e = select([self.sock], [], [])
+        if self.heartbeat_interval is None:
+            next_heartbeat = None
+        else:
+            next_heartbeat = monotonic() + self.heartbeat_interval
+
         while self.running:
+            if next_heartbeat is None:
+                timeout = None
+            else:
+                timeout = max(0, next_heartbeat - monotonic())
+
+            r, w, e = select([self.sock], [], [], timeout)
+            if not self.running:
+                break
+
             if self.sock in r:
                 try:
                     message = self.receive_message()
@@ -86,11 +173,21 @@ class AsyncSockClient(GameThread):
                         self.stop()
                         self.on_connection_close()
 
-                    else:
+                    elif not self._handle_heartbeat(message):
                         self.on_message_receive(message)
 
-            if self.running:
-                r, w, e = select([self.sock], [], [])
+            if (self.running and next_heartbeat is not None and
+                    monotonic() >= next_heartbeat):
+
+                if (self._peer_heartbeats and self._missed_heartbeats >=
+                        self.heartbeat_max_misses):
+
+                    self.stop()
+                    self.on_connection_abort()
+                    break
+
+                self.ping()
+                next_heartbeat = monotonic() + self.heartbeat_interval
 
     def stop(self):
         if not self.running:
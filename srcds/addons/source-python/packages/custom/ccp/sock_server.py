@@ -7,13 +7,17 @@ from .sock_client import AsyncSockClient
 
 
 class SockServer(GameThread):
-    def __init__(self, addr, whitelist=(), client_accept_callback=None):
+    def __init__(self, addr, whitelist=(), client_accept_callback=None,
+                 heartbeat_interval=None, heartbeat_max_misses=3):
+
         super().__init__()
 
         self.running = False
         self.clients = []
         self.whitelist = whitelist
         self.client_accept_callback = client_accept_callback
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_max_misses = heartbeat_max_misses
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.bind(addr)
@@ -34,7 +38,10 @@ class SockServer(GameThread):
                     client_sock.close()
                     continue
 
-                client = AsyncSockClient(self, client_sock)
+                client = AsyncSockClient(
+                    self, client_sock,
+                    heartbeat_interval=self.heartbeat_interval,
+                    heartbeat_max_misses=self.heartbeat_max_misses)
                 self.clients.append(client)
                 self.on_client_accept(addr, client)
 
@@ -47,8 +54,13 @@ class SockServer(GameThread):
             return
 
         self.running = False
-        for client in self.clients:
+
+        # Clients remove themselves from the list when stopped. They're
+        # told about the abort so that handlers relying on
+        # on_connection_abort get to clean up
+        for client in tuple(self.clients):
             client.stop()
+            client.on_connection_abort()
 
         self.sock.close()
 
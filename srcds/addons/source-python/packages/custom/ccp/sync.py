@@ -0,0 +1,155 @@
+from collections.abc import MutableMapping
+import json
+from threading import RLock
+
+from .constants import SYNC_BYTES_DELTA
+from .constants import SYNC_BYTES_FULL
+from .constants import SYNC_BYTES_RESYNC_REQUEST
+from .receive import RawReceiver
+
+
+def _encode(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class SyncedState(MutableMapping):
+    """Dict-like state that is mirrored to every attached
+    StateSyncReceiver.
+
+    Keys must be strings and values must be JSON-serializable.
+    Changes are only delivered when flush() is called, and only the keys
+    that have changed since the previous flush are sent. Values that are
+    mutated in place should be marked with touch().
+    """
+    def __init__(self, *args, **kwargs):
+        self._lock = RLock()
+        self._data = {}
+        self._dirty_keys = set()
+        self._removed_keys = set()
+        self._receivers = []
+
+        self.update(*args, **kwargs)
+        self._dirty_keys.clear()
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise ValueError("SyncedState keys must be str values")
+
+        with self._lock:
+            if key in self._data and self._data[key] == value:
+                return
+
+            # Raise at the call site rather than in a later flush()
+            _encode(value)
+
+            self._data[key] = value
+            self._dirty_keys.add(key)
+            self._removed_keys.discard(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+            self._dirty_keys.discard(key)
+            self._removed_keys.add(key)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def touch(self, key):
+        with self._lock:
+            if key not in self._data:
+                raise KeyError(key)
+
+            _encode(self._data[key])
+
+            self._dirty_keys.add(key)
+
+    def _send(self, receiver, data):
+        # A receiver whose connection has left raw mode can't be sent
+        # anything anymore, drop it instead of failing everyone else
+        try:
+            receiver.send_data(data)
+        except ValueError:
+            self.detach(receiver)
+            return False
+
+        return True
+
+    def attach(self, receiver):
+        with self._lock:
+            if self._send(receiver, SYNC_BYTES_FULL + _encode(self._data)):
+                self._receivers.append(receiver)
+
+    def detach(self, receiver):
+        with self._lock:
+            if receiver in self._receivers:
+                self._receivers.remove(receiver)
+
+    def send_snapshot(self, receiver):
+        with self._lock:
+            self._send(receiver, SYNC_BYTES_FULL + _encode(self._data))
+
+    def flush(self):
+        with self._lock:
+            if not (self._dirty_keys or self._removed_keys):
+                return
+
+            # Only forget the changes once they've been encoded, so that
+            # a failure doesn't lose them
+            data = SYNC_BYTES_DELTA + _encode({
+                's': {key: self._data[key] for key in self._dirty_keys},
+                'd': list(self._removed_keys),
+            })
+
+            # Dirty keys are cleared even if nobody is attached: new
+            # receivers always start from a full snapshot
+            self._dirty_keys.clear()
+            self._removed_keys.clear()
+
+            for receiver in tuple(self._receivers):
+                self._send(receiver, data)
+
+
+class StateSyncReceiver(RawReceiver):
+    """RawReceiver that mirrors a SyncedState to the other side.
+
+    Subclasses should set 'plugin_name' and 'state' class attributes.
+    A full snapshot is sent once the communication has been accepted and
+    whenever the other side asks for a resync.
+    """
+    abstract = True
+    state = None
+
+    def __init__(self, addr, ccp_receive_client):
+        if self.state is None:
+            raise ValueError("Class '{}' has its 'state' attribute set "
+                             "to None".format(type(self)))
+
+        super().__init__(addr, ccp_receive_client)
+
+        self._raw_stop = self.stop
+        self.stop = self._stop
+
+    def on_comm_accepted(self):
+        self.state.attach(self)
+
+    def _stop(self):
+        self.state.detach(self)
+        self._raw_stop()
+
+    def _unload_instance(self):
+        self.state.detach(self)
+        super()._unload_instance()
+
+    def on_data_received(self, data):
+        if data == SYNC_BYTES_RESYNC_REQUEST:
+            self.state.send_snapshot(self)
+
+    def on_connection_abort(self):
+        self.state.detach(self)
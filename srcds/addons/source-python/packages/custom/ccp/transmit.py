@@ -22,7 +22,8 @@ class AsyncSRCDSClient(WeakAutoUnload, GameThread):
                  comm_accepted_callback=None, nobody_home_callback=None,
                  comm_end_callback=None, protocol_error_callback=None,
                  comm_error_callback=None, data_received_callback=None,
-                 connected_callback=None, connection_abort_callback=None):
+                 connected_callback=None, connection_abort_callback=None,
+                 heartbeat_interval=None, heartbeat_max_misses=3):
 
         super().__init__()
 
@@ -30,6 +31,8 @@ class AsyncSRCDSClient(WeakAutoUnload, GameThread):
         self.plugin_name = plugin_name
         self._mode = CommunicationMode.UNDEFINED
         self._in_unload = False
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_max_misses = heartbeat_max_misses
 
         self._connection_error_callback = connection_error_callback
         self._comm_accepted_callback = comm_accepted_callback
@@ -71,12 +74,21 @@ class AsyncSRCDSClient(WeakAutoUnload, GameThread):
 
             self.sock_client = AsyncSockClient(
                 None, self.sock, self._message_receive_callback,
-                self.on_connection_abort, self.on_connection_abort)
+                self.on_connection_abort, self.on_connection_abort,
+                self.heartbeat_interval, self.heartbeat_max_misses)
 
             self.sock_client.start()
 
             self.on_connected()
 
+    @property
+    def rtt(self):
+        """Smoothed round-trip time in seconds, None if not measured."""
+        if self.sock_client is None:
+            return None
+
+        return self.sock_client.rtt
+
     def on_connection_error(self):
         """Called when connection to the host didn't succeed."""
         if self._connection_error_callback is not None: